@@ -4,6 +4,7 @@
 
 """Module defining the `OrderedResources` class."""
 
+import math
 import random
 from typing import List
 
@@ -85,7 +86,6 @@ class OrderedResources:
         if is_free:
             self._free_count += 1
 
-            print(self._free_count)
             if self._free_count > 2:
                 raise TooManyProbes()
         else:
@@ -94,38 +94,34 @@ class OrderedResources:
         return is_free
 
     def locate(self) -> int:
-        if self.size == 0:
-            raise AllResourcesInUse()
-
-        # Cache to store the results of is_resource_free
-        cache = {}
-        free_resource_found = False
-
-        for i in range(self.size):
-            if i not in cache:
-                cache[i] = self.is_resource_free(i)
-
-            if cache[i]:
-                if free_resource_found:
-                    # Second free resource found, return the previous one
-                    return i - 1
-                free_resource_found = True
-            else:
-                # Reset the flag if a busy resource is found after a free one
-                free_resource_found = False
-
-        if free_resource_found:
-            # The last resource is free
-            return self.size - 1
+        """
+        Return the index of the first available resource.
 
-        raise AllResourcesInUse()
+        Probes are spaced with a stride shrinking by one after each busy
+        resource so that, once a free resource is found, the remaining linear
+        scan is short enough to keep the worst case around `sqrt(2 * size)`
+        probes while `is_resource_free` returns `True` at most twice per call.
+        """
+        stride = math.ceil((math.sqrt(8 * self.size + 1) - 1) / 2)
+        lower = 0  # Every resource below `lower` is known to be busy.
 
-        raise NotImplementedError("Please implement this method.")
+        while lower < self.size:
+            probe = min(lower + stride, self.size) - 1
 
+            if self.is_resource_free(probe):
+                for index in range(lower, probe):
+                    if self.is_resource_free(index):
+                        return index
 
-# pylint: disable=protected-access,invalid-name
+                return probe
 
+            lower = probe + 1
+            stride = max(stride - 1, 1)
 
+        raise AllResourcesInUse()
+
+
+# pylint: disable=protected-access,invalid-name
 if __name__ == "__main__":
     POOL_SIZE = 100
     ITERATIONS = 100
@@ -138,9 +134,7 @@ if __name__ == "__main__":
 
         try:
             next_free = pool.locate()
-        except NotImplementedError:
-            raise
-        except Exception:  # pylint: disable=broad-except
+        except AllResourcesInUse:
             if pool.size != pool._first_available_resource:
                 correctness = False
         else:
@@ -4,15 +4,17 @@
 
 """Mock server implemented in Flask."""
 
+import os
 import time
 import uuid
 from dataclasses import asdict, dataclass
 from random import randint
 from threading import Lock
-from typing import Dict, List, Set
+from typing import Any, Dict, FrozenSet, Iterable, List, Set, Tuple
 
+import orjson
 import requests
-from flask import Flask, jsonify
+from flask import Flask, Response, request
 
 NUMBER_OF_ENDPOINTS = 50
 
@@ -22,15 +24,64 @@ MAXIMUM_RESOURCES_BY_ENDPOINT = 10
 
 RANDOM_WORDS_SOURCE = "https://www.mit.edu/~ecprice/wordlist.10000"
 
+# Seconds resource queries (single or batched) sleep to simulate a slow legacy server (disabled when unset).
+ARTIFICIAL_LATENCY = float(os.environ.get("SYNTAX_ARTIFICIAL_LATENCY", "0"))
+
 API = Flask(__name__)
 
 
-@dataclass
+def fast_json(obj: Any) -> Response:
+    """Serialize `obj` with `orjson`, which is significantly faster than `jsonify`."""
+    return API.response_class(orjson.dumps(obj), mimetype="application/json")
+
+
+@dataclass(frozen=True)
 class Endpoint:
-    """State of a resource on a specific endpoint."""
+    """Resources exposed by a specific endpoint; its lock state lives in `LOCKS`."""
+
+    resources: FrozenSet[int]
+
+
+class EndpointLocks:
+    """
+    Lock state of all endpoints packed in a single integer, one bit by endpoint.
+
+    A single mutex serializes updates; reading the state of every endpoint at
+    once only takes a snapshot of `bits`.
+    """
+
+    def __init__(self, names: Iterable[str]):
+        self.masks: Dict[str, int] = {name: 1 << index for index, name in enumerate(names)}
+        self.bits = 0
+        self._guard = Lock()
+
+    def acquire(self, name: str) -> bool:
+        """Lock the endpoint `name`, returning `False` if it was already locked."""
+        mask = self.masks[name]
+
+        with self._guard:
+            if self.bits & mask:
+                return False
+
+            self.bits |= mask
+
+        return True
+
+    def release(self, name: str) -> bool:
+        """Unlock the endpoint `name`, returning `False` if it was already unlocked."""
+        mask = self.masks[name]
+
+        with self._guard:
+            if not self.bits & mask:
+                return False
+
+            self.bits &= ~mask
+
+        return True
 
-    resources: List[int]
-    lock: Lock
+    def locked(self, name: str) -> bool:
+        """Return `True` if and only if the endpoint `name` is locked."""
+        return bool(self.bits & self.masks[name])
 
 
 def initialize_registry() -> Dict[str, Endpoint]:
@@ -46,60 +97,118 @@ def initialize_registry() -> Dict[str, Endpoint]:
             resource_id = randint(MINIMUM_RESOURCE_ID, MAXIMUM_RESOURCE_ID + 1)
             resources.add(resource_id)
 
-        mock_registry[endpoint] = Endpoint(resources=list(resources), lock=Lock())
+        mock_registry[endpoint] = Endpoint(resources=frozenset(resources))
 
     return mock_registry
 
 
 REGISTRY = initialize_registry()
 
+# The registry is read-only once initialized: only the lock state of each endpoint changes. Each entry of the
+# `/registry` response is serialized once, up to its `locked` flag, e.g. `"<name>":{"resources":[...],"locked":`.
+ENDPOINT_NAMES: Tuple[str, ...] = tuple(REGISTRY)
+ENDPOINT_RESOURCES_JSON: Dict[str, bytes] = {
+    name: orjson.dumps(name) + b':{"resources":' + orjson.dumps(sorted(endpoint.resources)) + b',"locked":'
+    for name, endpoint in REGISTRY.items()
+}
+LOCKS = EndpointLocks(ENDPOINT_NAMES)
+
+# Weak validator of the registry: it only covers the resources exposed by each endpoint, not their lock state.
+REGISTRY_ETAG = format(
+    hash(frozenset((name, endpoint.resources) for name, endpoint in REGISTRY.items())) & (2**64 - 1), "x"
+)
+
 
 @API.route("/registry", methods=["GET"])
 def registry():
-    """Return the full registry in JSON."""
-    return jsonify(
-        {name: {"resources": endpoint.resources, "locked": endpoint.lock.locked()} for name, endpoint in REGISTRY.items()}
-    )
+    """
+    Return the full registry in JSON.
+
+    Clients sending back the registry's `ETag` in `If-None-Match` get an empty
+    `304 Not Modified` response as long as the exposed resources did not change.
+    """
+    if request.if_none_match.contains_weak(REGISTRY_ETAG):
+        response = API.response_class(status=304)
+    else:
+        bits = LOCKS.bits
+        body = b",".join(
+            ENDPOINT_RESOURCES_JSON[name] + (b"true}" if bits & LOCKS.masks[name] else b"false}")
+            for name in ENDPOINT_NAMES
+        )
+        response = API.response_class(b"{" + body + b"}", mimetype="application/json")
+
+    response.set_etag(REGISTRY_ETAG, weak=True)
+    return response
 
 
 @API.route("/<endpoint>/lock", methods=["POST"])
 def lock(endpoint: str):
     """Lock the given endpoint for exclusive access."""
     if endpoint not in REGISTRY:
-        return jsonify({"error": f"'{endpoint}' not found"}), 404
+        return fast_json({"error": f"'{endpoint}' not found"}), 404
 
-    if not REGISTRY[endpoint].lock.acquire(blocking=False):
-        return jsonify({"error": f"'{endpoint}' is already locked"}), 403
+    if not LOCKS.acquire(endpoint):
+        return fast_json({"error": f"'{endpoint}' is already locked"}), 403
 
-    return jsonify({}), 200
+    return fast_json({}), 200
 
 
 @API.route("/<endpoint>/lock", methods=["DELETE"])
 def unlock(endpoint: str):
     """Unlock a previously locked endpoint."""
     if endpoint not in REGISTRY:
-        return jsonify({"error": f"'{endpoint}' not found"}), 404
+        return fast_json({"error": f"'{endpoint}' not found"}), 404
 
-    try:
-        REGISTRY[endpoint].lock.release()
-    except RuntimeError:
-        return jsonify({"error": f"'{endpoint}' is already unlocked"}), 403
+    if not LOCKS.release(endpoint):
+        return fast_json({"error": f"'{endpoint}' is already unlocked"}), 403
 
-    return jsonify({}), 200
+    return fast_json({}), 200
 
 
-@API.route("/<endpoint>/resource/<resource_id>", methods=["GET"])
-def get(endpoint: str, resource_id: str):
-    """Get mocked state associated with a resource ID."""
+def query_states(endpoint: str, resource_ids: List[int]) -> Tuple[Dict[str, Any], int]:
+    """Return the JSON payload and status code of a query for the mocked states of some resources."""
     if endpoint not in REGISTRY:
-        return jsonify({"error": f"'{endpoint}' not found"}), 404
+        return {"error": f"'{endpoint}' not found"}, 404
+
+    for resource_id in resource_ids:
+        if resource_id not in REGISTRY[endpoint].resources:
+            return {"error": f"'{endpoint}' does not expose resource '{resource_id}'"}, 404
+
+    if not LOCKS.locked(endpoint):  # If this was real life, this would be a race condition.
+        return {"error": f"'{endpoint}' must be locked to access its state"}, 403
+
+    if ARTIFICIAL_LATENCY:
+        time.sleep(ARTIFICIAL_LATENCY)  # To be able to compute meaningful performance metrics.
+
+    return {"states": {str(resource_id): uuid.uuid4().hex for resource_id in resource_ids}}, 200
 
-    if int(resource_id) not in REGISTRY[endpoint].resources:
-        return jsonify({"error": f"'{endpoint}' does not expose resource '{resource_id}'"}), 404
 
-    if not REGISTRY[endpoint].lock.locked:  # If this was real life, this would be a race condition.
-        return jsonify({"error": f"'{endpoint}' must be locked to access its state"}), 403
+@API.route("/<endpoint>/resource/<int:resource_id>", methods=["GET"])
+def get(endpoint: str, resource_id: int):
+    """Get mocked state associated with a resource ID."""
+    payload, status = query_states(endpoint, [resource_id])
+
+    if status == 200:
+        payload = {"state": payload["states"][str(resource_id)]}
+
+    return fast_json(payload), status
+
+
+@API.route("/<endpoint>/resources", methods=["GET"])
+def get_many(endpoint: str):
+    """
+    Get mocked states associated with the comma separated resource IDs in the `ids` query parameter.
+
+    Behaves as `GET /<endpoint>/resource/<resource_id>` for each ID but pays the artificial latency only once.
+    """
+    try:
+        resource_ids = [int(value) for value in request.args.get("ids", "").split(",") if value]
+    except ValueError:
+        return fast_json({"error": "'ids' must be a comma separated list of resource IDs"}), 400
+
+    payload, status = query_states(endpoint, resource_ids)
+    return fast_json(payload), status
 
-    time.sleep(0.1)  # To be able to compute meaningful performance metrics.
 
-    return jsonify({"state": uuid.uuid4().hex}), 200
+if __name__ == "__main__":
+    API.run(threaded=True)
@@ -4,16 +4,25 @@
 
 """Client module to interact with the question's server."""
 
+import atexit
 import random
 import time
-from concurrent.futures import Future, ThreadPoolExecutor
+from collections import defaultdict
+from concurrent.futures import Future, ThreadPoolExecutor, as_completed, wait
+from contextlib import ExitStack
 from dataclasses import dataclass
-from typing import Dict, List
+from threading import Lock
+from typing import DefaultDict, Dict, List, Optional, Tuple
 
-import requests
+import orjson
 import rich
-from threading import Lock
-from concurrent.futures import ThreadPoolExecutor
+import urllib3
+
+# Bounds, in seconds, of the exponential backoff used while waiting for an endpoint locked by someone else.
+LOCK_RETRY_BASE_DELAY = 0.001
+LOCK_RETRY_MAX_DELAY = 0.1
+# Seconds to wait for an endpoint locked by someone else before giving up: the server cannot release forgotten locks.
+LOCK_RETRY_TIMEOUT = 10.0
 
 
 class EndpointNotFound(RuntimeError):
@@ -63,17 +72,41 @@ class Client:  # pylint: disable=too-few-public-methods
     def __init__(self, url: str, port: int):
         self.url = url
         self.port = port
-        self.lock = Lock()  # Ensure there is a lock for synchronization
-        self.session = requests.Session()  # Use a Session object for connection pooling
-
-    def _find_endpoints_for_resources(self, registry: Dict[str, Endpoint], resource_ids: List[int]) -> List[str]:
-        endpoints = []
-        for resource_id in resource_ids:
-            for endpoint, endpoint_info in registry.items():
-                if resource_id in endpoint_info.resource_ids and endpoint not in endpoints:
-                    endpoints.append(endpoint)
-                    break
-        return endpoints
+        self._endpoint_locks: Dict[str, Lock] = {}
+        self.pool = urllib3.PoolManager(num_pools=1, maxsize=200, block=False, retries=False)  # Connection pooling
+        self._unlock_executor = ThreadPoolExecutor(max_workers=16, thread_name_prefix="syntax-unlock")
+        self._fetch_executor = ThreadPoolExecutor(max_workers=32, thread_name_prefix="syntax-fetch")
+        atexit.register(self._unlock_executor.shutdown)
+        atexit.register(self._fetch_executor.shutdown)
+        self._registry_cache: Optional[Dict[str, Endpoint]] = None
+        self._registry_etag: Optional[str] = None
+        self._registry_ts = 0.0
+        self._registry_ttl = 5.0  # Seconds the registry is reused before being revalidated with the server
+        self._cached_index: Optional[Tuple[Dict[str, Endpoint], Dict[int, str]]] = None
+
+    def _resource_index(self, registry: Dict[str, Endpoint]) -> Dict[int, str]:
+        """
+        Map each resource ID to the first endpoint exposing it in `registry`.
+
+        The index of the last registry seen is cached so queries sharing the
+        same registry only build it once.
+        """
+        cached = self._cached_index
+        if cached is not None and cached[0] is registry:
+            return cached[1]
+
+        index: Dict[int, str] = {}
+        for endpoint, endpoint_info in registry.items():
+            for resource_id in endpoint_info.resource_ids:
+                index.setdefault(resource_id, endpoint)
+
+        self._cached_index = (registry, index)
+        return index
+
+    def _plan_resources(self, registry: Dict[str, Endpoint], resource_ids: List[int]) -> Dict[int, str]:
+        """Map each requested resource ID exposed in `registry` to the endpoint it will be fetched from."""
+        index = self._resource_index(registry)
+        return {resource_id: index[resource_id] for resource_id in resource_ids if resource_id in index}
     
     # def query_synchronized_resources(self, *resource_ids) -> Dict[int, str]:
     #     with self.lock:
@@ -118,11 +151,31 @@ class Client:  # pylint: disable=too-few-public-methods
 
         Returns a dictionary which map the endpoint to the information contain
         wherein.
+
+        The registry is cached for `self._registry_ttl` seconds, after which it
+        is revalidated using its `ETag`.
         """
-        response = requests.get(f"http://{self.url}:{self.port}/registry")
-        assert response.status_code == 200
+        if self._registry_cache is not None and time.monotonic() - self._registry_ts < self._registry_ttl:
+            return self._registry_cache
+
+        headers = {"If-None-Match": self._registry_etag} if self._registry_etag and self._registry_cache else {}
+        response = self.pool.request("GET", f"http://{self.url}:{self.port}/registry", headers=headers)
+
+        if response.status == 304 and self._registry_cache is not None:
+            self._registry_ts = time.monotonic()
+            return self._registry_cache
+
+        assert response.status == 200
+
+        registry = {
+            key: Endpoint(resource_ids=value["resources"]) for key, value in orjson.loads(response.data).items()
+        }
 
-        return {key: Endpoint(resource_ids=value["resources"]) for key, value in response.json().items()}
+        self._registry_cache = registry
+        self._registry_etag = response.headers.get("ETag")
+        self._registry_ts = time.monotonic()
+
+        return registry
 
     def _lock_endpoint(self, endpoint: str):
         """
@@ -130,16 +183,15 @@ class Client:  # pylint: disable=too-few-public-methods
 
         Locking an endpoint allows us to retrieve its state.
         """
-        # response = requests.post(f"http://{self.url}:{self.port}/{endpoint}/lock")
-        response = self.session.post(f"http://{self.url}:{self.port}/{endpoint}/lock")
+        response = self.pool.request("POST", f"http://{self.url}:{self.port}/{endpoint}/lock")
 
-        if response.status_code == 403:
+        if response.status == 403:
             raise EndpointAlreadyLocked()
 
-        if response.status_code == 404:
+        if response.status == 404:
             raise EndpointNotFound()
 
-        assert response.status_code == 200
+        assert response.status == 200
 
     def _unlock_endpoint(self, endpoint: str):
         """
@@ -148,16 +200,15 @@ class Client:  # pylint: disable=too-few-public-methods
         It is important to always unlock endpoints after usage as the server as
         no way to unlock forgotten locked.
         """
-        # response = requests.delete(f"http://{self.url}:{self.port}/{endpoint}/lock")
-        response = self.session.delete(f"http://{self.url}:{self.port}/{endpoint}/lock")
+        response = self.pool.request("DELETE", f"http://{self.url}:{self.port}/{endpoint}/lock")
 
-        if response.status_code == 403:
+        if response.status == 403:
             raise EndpointAlreadyUnlocked()
 
-        if response.status_code == 404:
+        if response.status == 404:
             raise EndpointNotFound()
 
-        assert response.status_code == 200
+        assert response.status == 200
 
     def _get_resource(self, endpoint: str, resource_id: int) -> str:
         """
@@ -165,61 +216,136 @@ class Client:  # pylint: disable=too-few-public-methods
 
         The state will be "synchronized" with the state of all locked endpoints.
         """
-        response = self.session.get(f"http://{self.url}:{self.port}/{endpoint}/resource/{resource_id}")
+        response = self.pool.request("GET", f"http://{self.url}:{self.port}/{endpoint}/resource/{resource_id}")
+
+        if response.status == 403:
+            raise TryingToAccessResourceOnUnlockedEndpoint()
+
+        if response.status == 404:
+            raise ResourceNotFound()
+
+        assert response.status == 200
+
+        return orjson.loads(response.data)["state"]
+
+    def _get_resources(self, endpoint: str, resource_ids: List[int]) -> Dict[int, str]:
+        """
+        Query the state of several resources from a specific endpoint in a single request.
+
+        The states will be "synchronized" with the state of all locked endpoints.
+        """
+        ids = ",".join(str(resource_id) for resource_id in resource_ids)
+        response = self.pool.request("GET", f"http://{self.url}:{self.port}/{endpoint}/resources?ids={ids}")
 
-        if response.status_code == 403:
+        if response.status == 403:
             raise TryingToAccessResourceOnUnlockedEndpoint()
 
-        if response.status_code == 404:
+        if response.status == 404:
             raise ResourceNotFound()
 
-        assert response.status_code == 200
+        assert response.status == 200
 
-        return response.json()["state"]
+        return {int(resource_id): state for resource_id, state in orjson.loads(response.data)["states"].items()}
 
     def query_synchronized_resources(self, *resource_ids) -> Dict[int, str]:
-        with self.lock:
-            # Step 1: Query the registry from the server
-            registry = self._get_registry()
+        if not resource_ids:
+            return {}
 
-            # Step 2: Find suitable endpoints that serve the necessary resources
-            endpoints = self._find_endpoints_for_resources(registry, list(resource_ids))
+        # Step 1: Query the registry from the server
+        registry = self._get_registry()
+
+        # Step 2: Find suitable endpoints that serve the necessary resources
+        plan = self._plan_resources(registry, list(resource_ids))
+
+        if not plan:
+            return {}  # No endpoint to lock nor resource to fetch
+
+        endpoints = sorted(set(plan.values()))
+
+        with ExitStack() as stack:
+            # Only one query of this client may hold a given endpoint at a time; locks are taken in
+            # sorted order so two queries sharing endpoints can never deadlock on each other.
+            for endpoint in endpoints:
+                stack.enter_context(self._endpoint_lock(endpoint))
 
             # Step 3: Lock all endpoints that will be used to query state
             locked_endpoints = self._lock_endpoints(endpoints)
 
-            # Step 4: Query the state of all desired resources in parallel
-            with ThreadPoolExecutor() as executor:
-                future_to_resource_id = {
-                    executor.submit(self._get_resource, endpoint, resource_id): resource_id
-                    for resource_id in resource_ids
-                    for endpoint in endpoints
-                    if resource_id in registry[endpoint].resource_ids
-                }
-                resource_states = {future_to_resource_id[future]: future.result() for future in future_to_resource_id}
-
-            # Step 5: Unlock all endpoints previously locked
+            try:
+                # Step 4: Query the state of all desired resources in parallel
+                resource_ids_by_endpoint: DefaultDict[str, List[int]] = defaultdict(list)
+                for resource_id, endpoint in plan.items():
+                    resource_ids_by_endpoint[endpoint].append(resource_id)
+
+                futures = [
+                    self._fetch_executor.submit(self._get_resources, endpoint, endpoint_resource_ids)
+                    for endpoint, endpoint_resource_ids in resource_ids_by_endpoint.items()
+                ]
+                wait(futures)  # Endpoints may only be unlocked once every fetch is done.
+
+                resource_states: Dict[int, str] = {}
+                for future in futures:
+                    resource_states.update(future.result())
+            finally:
+                # Step 5: Unlock all endpoints previously locked
+                self._unlock_endpoints(locked_endpoints)
+
+        return resource_states
+
+    def _endpoint_lock(self, endpoint: str) -> Lock:
+        """Return the lock guarding `endpoint` against concurrent queries of this client."""
+        lock = self._endpoint_locks.get(endpoint)
+        if lock is None:
+            lock = self._endpoint_locks.setdefault(endpoint, Lock())
+        return lock
+
+    def _lock_endpoints(self, endpoints: List[str]) -> List[str]:
+        """
+        Lock `endpoints` one at a time, in the given (sorted) order.
+
+        Endpoints locked by someone else are waited for. Since every query
+        locks its endpoints in the same global order, two queries can never
+        each hold an endpoint the other one is waiting for.
+        """
+        locked_endpoints: List[str] = []
+        try:
+            for endpoint in endpoints:
+                self._lock_endpoint_with_backoff(endpoint)
+                locked_endpoints.append(endpoint)
+        except BaseException:
             self._unlock_endpoints(locked_endpoints)
+            raise
+        return locked_endpoints
 
-            return resource_states
+    def _lock_endpoint_with_backoff(self, endpoint: str):
+        """
+        Lock an endpoint, retrying with an exponential backoff while it is locked by someone else.
 
-    def _lock_endpoints(self, endpoints: List[str]) -> List[str]:
-        locked_endpoints = []
-        for endpoint in endpoints:
+        Raises `EndpointAlreadyLocked` if the endpoint is still locked after `LOCK_RETRY_TIMEOUT` seconds.
+        """
+        deadline = time.monotonic() + LOCK_RETRY_TIMEOUT
+        attempt = 0
+        while True:
             try:
                 self._lock_endpoint(endpoint)
-                locked_endpoints.append(endpoint)
+                return
             except EndpointAlreadyLocked:
-                pass  # If already locked, we assume it's locked by this client
-        return locked_endpoints
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise
+
+                time.sleep(min(LOCK_RETRY_BASE_DELAY * 2**attempt, LOCK_RETRY_MAX_DELAY, remaining))
+                attempt += 1
 
     def _unlock_endpoints(self, endpoints: List[str]):
-        for endpoint in endpoints:
+        futures = [self._unlock_executor.submit(self._unlock_endpoint, endpoint) for endpoint in endpoints]
+        for future in as_completed(futures):
             try:
-                self._unlock_endpoint(endpoint)
+                future.result()
             except EndpointAlreadyUnlocked:
                 pass  # If already unlocked, we continue with the next one
-            
+
+
 # pylint: disable=protected-access,invalid-name
 
 
@@ -227,12 +353,8 @@ if __name__ == "__main__":
     client = Client("127.0.0.1", 5000)
     registry = client._get_registry()
 
-    available_resources: List[int] = []
-
-    for obj in registry.values():
-        for resource in obj.resource_ids:
-            if resource not in available_resources:
-                available_resources.append(resource)
+    available_resources: List[int] = sorted({resource for obj in registry.values() for resource in obj.resource_ids})
+    rng = random.Random(42)  # Seeded so runs against the same registry issue the same queries.
 
     request_times: List[float] = []
     futures: List[Future] = []
@@ -248,10 +370,8 @@ if __name__ == "__main__":
 
     with ThreadPoolExecutor(max_workers=100) as executor:
         for _ in range(0, 1000):
-            number_of_resources = random.randint(0, 10)
-            random.shuffle(available_resources)
-
-            sample = list(random.sample(available_resources, number_of_resources))
+            number_of_resources = rng.randint(0, 10)
+            sample = rng.sample(available_resources, number_of_resources)
             futures.append(executor.submit(_timed_query, sample))
 
         for future in futures: